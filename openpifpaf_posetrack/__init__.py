@@ -1,6 +1,6 @@
 import openpifpaf
 
-from . import decoder, headmeta, heads
+from . import decoder, headmeta, heads, losses
 from .backbone import TBackbone
 from .cocokpst import CocoKpSt
 from .posetrack2018 import Posetrack2018
@@ -56,9 +56,9 @@ def register():
     openpifpaf.HEADS[headmeta.TBaseCaf] = heads.TBaseSingleImage
     openpifpaf.HEADS[headmeta.Tcaf] = heads.Tcaf
 
-    openpifpaf.LOSSES[headmeta.TBaseCif] = openpifpaf.network.losses.CompositeLoss
-    openpifpaf.LOSSES[headmeta.TBaseCaf] = openpifpaf.network.losses.CompositeLoss
-    openpifpaf.LOSSES[headmeta.Tcaf] = openpifpaf.network.losses.CompositeLoss
+    openpifpaf.LOSSES[headmeta.TBaseCif] = losses.CompositeLoss
+    openpifpaf.LOSSES[headmeta.TBaseCaf] = losses.CompositeLoss
+    openpifpaf.LOSSES[headmeta.Tcaf] = losses.CompositeLoss
 
     openpifpaf.BASE_TYPES.add(TBackbone)
     openpifpaf.BASE_FACTORIES['tshufflenetv2k16'] = lambda: TBackbone(
@@ -3,6 +3,7 @@ import argparse
 import torch
 
 import openpifpaf
+from openpifpaf.plugins.coco import CocoDataset, CocoKp
 from openpifpaf.plugins.coco.constants import (
     COCO_CATEGORIES,
     COCO_KEYPOINTS,
@@ -13,7 +14,8 @@ from openpifpaf.plugins.coco.constants import (
     DENSER_COCO_PERSON_CONNECTIONS,
     HFLIP,
 )
-from . import collate, encoder, headmeta, transforms
+from . import encoder, headmeta, transforms
+from .posetrack2018 import Posetrack2018
 from .transforms import SingleImage as S
 
 try:
@@ -61,11 +63,11 @@ class CocoKpSt(openpifpaf.datasets.DataModule):
             only_in_field_of_view=True,
         )
 
-        cif.upsample_stride = openpifpaf.plugins.coco.CocoKp.upsample_stride
-        caf.upsample_stride = openpifpaf.plugins.coco.CocoKp.upsample_stride
-        dcaf.upsample_stride = openpifpaf.plugins.coco.CocoKp.upsample_stride
-        tcaf.upsample_stride = openpifpaf.plugins.coco.CocoKp.upsample_stride
         self.head_metas = [cif, caf, dcaf, tcaf]
+        for hm in self.head_metas:
+            hm.upsample_stride = CocoKp.upsample_stride
+
+        self._preprocess_cache = {}
 
     @classmethod
     def cli(cls, parser: argparse.ArgumentParser):
@@ -78,7 +80,27 @@ class CocoKpSt(openpifpaf.datasets.DataModule):
         pass
 
     def _preprocess(self):
-        bmin = openpifpaf.plugins.coco.CocoKp.bmin
+        # the configuration can change between calls through configure() and
+        # head metas can be replaced when loading a checkpoint
+        key = (
+            'train',
+            CocoKp.bmin,
+            CocoKp.augmentation,
+            CocoKp.square_edge,
+            CocoKp.extended_scale,
+            CocoKp.rescale_images,
+            CocoKp.orientation_invariant,
+            CocoKp.blur,
+            Posetrack2018.target_dtype,
+            tuple(id(m) for m in self.head_metas),
+        )
+        if key not in self._preprocess_cache:
+            self._preprocess_cache[key] = self._build_preprocess()
+        return self._preprocess_cache[key]
+
+    def _build_preprocess(self):
+        bmin = CocoKp.bmin
+        target_dtype = Posetrack2018.target_torch_dtype()
         encoders = (
             encoder.SingleImage(openpifpaf.encoder.Cif(self.head_metas[0], bmin=bmin)),
             encoder.SingleImage(openpifpaf.encoder.Caf(self.head_metas[1], bmin=bmin)),
@@ -86,25 +108,23 @@ class CocoKpSt(openpifpaf.datasets.DataModule):
             encoder.Tcaf(self.head_metas[3], bmin=bmin),
         )
 
-        if not openpifpaf.plugins.coco.CocoKp.augmentation:
+        if not CocoKp.augmentation:
             return openpifpaf.transforms.Compose([
                 openpifpaf.transforms.NormalizeAnnotations(),
-                openpifpaf.transforms.RescaleAbsolute(openpifpaf.plugins.coco.CocoKp.square_edge),
-                openpifpaf.transforms.CenterPad(openpifpaf.plugins.coco.CocoKp.square_edge),
+                openpifpaf.transforms.RescaleAbsolute(CocoKp.square_edge),
+                openpifpaf.transforms.CenterPad(CocoKp.square_edge),
                 transforms.ImageToTracking(),
                 S(openpifpaf.transforms.EVAL_TRANSFORM),
-                transforms.Encoders(encoders),
+                transforms.Encoders(encoders, target_dtype=target_dtype),
             ])
 
-        if openpifpaf.plugins.coco.CocoKp.extended_scale:
+        if CocoKp.extended_scale:
             rescale_t = openpifpaf.transforms.RescaleRelative(
-                scale_range=(0.25 * openpifpaf.plugins.coco.CocoKp.rescale_images,
-                             2.0 * openpifpaf.plugins.coco.CocoKp.rescale_images),
+                scale_range=(0.25 * CocoKp.rescale_images, 2.0 * CocoKp.rescale_images),
                 power_law=True, stretch_range=(0.75, 1.33))
         else:
             rescale_t = openpifpaf.transforms.RescaleRelative(
-                scale_range=(0.4 * openpifpaf.plugins.coco.CocoKp.rescale_images,
-                             2.0 * openpifpaf.plugins.coco.CocoKp.rescale_images),
+                scale_range=(0.4 * CocoKp.rescale_images, 2.0 * CocoKp.rescale_images),
                 power_law=True, stretch_range=(0.75, 1.33))
 
         return openpifpaf.transforms.Compose([
@@ -117,60 +137,72 @@ class CocoKpSt(openpifpaf.datasets.DataModule):
             S(openpifpaf.transforms.RandomChoice(
                 [openpifpaf.transforms.RotateBy90(),
                  openpifpaf.transforms.RotateUniform(30.0)],
-                [openpifpaf.plugins.coco.CocoKp.orientation_invariant, 0.4],
+                [CocoKp.orientation_invariant, 0.4],
             )),
-            transforms.Crop(openpifpaf.plugins.coco.CocoKp.square_edge, max_shift=30.0),
-            transforms.Pad(openpifpaf.plugins.coco.CocoKp.square_edge, max_shift=30.0),
-            S(openpifpaf.transforms.RandomApply(openpifpaf.transforms.Blur(),
-                                                openpifpaf.plugins.coco.CocoKp.blur / 2.0)),
-            S(openpifpaf.transforms.RandomApply(transforms.HorizontalBlur(),
-                                                openpifpaf.plugins.coco.CocoKp.blur / 2.0)),
+            transforms.Crop(CocoKp.square_edge, max_shift=30.0),
+            transforms.Pad(CocoKp.square_edge, max_shift=30.0),
+            S(openpifpaf.transforms.RandomApply(openpifpaf.transforms.Blur(), CocoKp.blur / 2.0)),
+            S(openpifpaf.transforms.RandomApply(transforms.HorizontalBlur(), CocoKp.blur / 2.0)),
             S(openpifpaf.transforms.TRAIN_TRANSFORM),
-            transforms.Encoders(encoders),
+            transforms.Encoders(encoders, target_dtype=target_dtype),
         ])
 
     def train_loader(self):
-        train_data = openpifpaf.plugins.coco.CocoDataset(
-            image_dir=openpifpaf.plugins.coco.CocoKp.train_image_dir,
-            ann_file=openpifpaf.plugins.coco.CocoKp.train_annotations,
+        train_data = CocoDataset(
+            image_dir=CocoKp.train_image_dir,
+            ann_file=CocoKp.train_annotations,
             preprocess=self._preprocess(),
             annotation_filter=True,
-            min_kp_anns=openpifpaf.plugins.coco.CocoKp.min_kp_anns,
+            min_kp_anns=CocoKp.min_kp_anns,
             category_ids=[1],
         )
         return torch.utils.data.DataLoader(
             train_data,
             batch_size=self.batch_size // 2,
-            shuffle=(not openpifpaf.plugins.coco.CocoKp.debug
-                     and openpifpaf.plugins.coco.CocoKp.augmentation),
-            pin_memory=openpifpaf.plugins.coco.CocoKp.pin_memory,
+            shuffle=not CocoKp.debug and CocoKp.augmentation,
+            pin_memory=CocoKp.pin_memory,
             num_workers=self.loader_workers,
             drop_last=True,
-            collate_fn=collate.collate_tracking_images_targets_meta,
+            collate_fn=Posetrack2018.tracking_collate(),
+            **Posetrack2018.worker_kwargs(self.loader_workers),
         )
 
     def val_loader(self):
-        val_data = openpifpaf.plugins.coco.CocoDataset(
-            image_dir=openpifpaf.plugins.coco.CocoKp.val_image_dir,
-            ann_file=openpifpaf.plugins.coco.CocoKp.val_annotations,
+        val_data = CocoDataset(
+            image_dir=CocoKp.val_image_dir,
+            ann_file=CocoKp.val_annotations,
             preprocess=self._preprocess(),
             annotation_filter=True,
-            min_kp_anns=openpifpaf.plugins.coco.CocoKp.min_kp_anns,
+            min_kp_anns=CocoKp.min_kp_anns,
             category_ids=[1],
         )
         return torch.utils.data.DataLoader(
             val_data,
             batch_size=self.batch_size // 2,
             shuffle=False,
-            pin_memory=openpifpaf.plugins.coco.CocoKp.pin_memory,
+            pin_memory=CocoKp.pin_memory,
             num_workers=self.loader_workers,
             drop_last=True,
-            collate_fn=collate.collate_tracking_images_targets_meta,
+            collate_fn=Posetrack2018.tracking_collate(),
+            **Posetrack2018.worker_kwargs(self.loader_workers),
         )
 
     def _eval_preprocess(self):
+        key = (
+            'eval',
+            CocoKp.eval_long_edge,
+            CocoKp.eval_extended_scale,
+            CocoKp.eval_orientation_invariant,
+            CocoKp.batch_size,
+            tuple(id(m) for m in self.head_metas),
+        )
+        if key not in self._preprocess_cache:
+            self._preprocess_cache[key] = self._build_eval_preprocess()
+        return self._preprocess_cache[key]
+
+    def _build_eval_preprocess(self):
         return openpifpaf.transforms.Compose([
-            *openpifpaf.plugins.coco.CocoKp.common_eval_preprocess(),
+            *CocoKp.common_eval_preprocess(),
             openpifpaf.transforms.ToAnnotations([
                 openpifpaf.transforms.ToKpAnnotations(
                     COCO_CATEGORIES,
@@ -183,29 +215,28 @@ class CocoKpSt(openpifpaf.datasets.DataModule):
         ])
 
     def eval_loader(self):
-        eval_data = openpifpaf.plugins.coco.CocoDataset(
-            image_dir=openpifpaf.plugins.coco.CocoKp.eval_image_dir,
-            ann_file=openpifpaf.plugins.coco.CocoKp.eval_annotations,
+        eval_data = CocoDataset(
+            image_dir=CocoKp.eval_image_dir,
+            ann_file=CocoKp.eval_annotations,
             preprocess=self._eval_preprocess(),
-            annotation_filter=openpifpaf.plugins.coco.CocoKp.eval_annotation_filter,
-            min_kp_anns=(openpifpaf.plugins.coco.CocoKp.min_kp_anns
-                         if openpifpaf.plugins.coco.CocoKp.eval_annotation_filter
-                         else 0),
-            category_ids=[1] if openpifpaf.plugins.coco.CocoKp.eval_annotation_filter else [],
+            annotation_filter=CocoKp.eval_annotation_filter,
+            min_kp_anns=CocoKp.min_kp_anns if CocoKp.eval_annotation_filter else 0,
+            category_ids=[1] if CocoKp.eval_annotation_filter else [],
         )
         return torch.utils.data.DataLoader(
             eval_data,
             batch_size=self.batch_size,
             shuffle=False,
-            pin_memory=openpifpaf.plugins.coco.CocoKp.pin_memory,
+            pin_memory=CocoKp.pin_memory,
             num_workers=self.loader_workers,
             drop_last=False,
             collate_fn=openpifpaf.datasets.collate_images_anns_meta,
+            **Posetrack2018.worker_kwargs(self.loader_workers),
         )
 
     def metrics(self):
         return [openpifpaf.metric.Coco(
-            pycocotools.coco.COCO(openpifpaf.plugins.coco.CocoKp.eval_annotations),
+            pycocotools.coco.COCO(CocoKp.eval_annotations),
             max_per_image=20,
             category_ids=[1],
             iou_type='keypoints',
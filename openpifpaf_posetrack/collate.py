@@ -1,9 +1,11 @@
 import torch
 
 
-def collate_tracking_images_targets_meta(batch):
+def collate_tracking_images_targets_meta(batch, *, channels_last=False):
     images = torch.utils.data.dataloader.default_collate([
         im for group in batch for im in group[0]])
+    if channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
 
     targets = torch.utils.data.dataloader.default_collate([b[1] for b in batch])
     metas = [b[2] for b in batch]
@@ -8,9 +8,21 @@ import PIL
 import pysparkling
 import torch
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 LOG = logging.getLogger(__name__)
 
 
+def json_loads(text):
+    """Parse annotation json, with orjson when it is available."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
 class Posetrack2018(torch.utils.data.Dataset):
     """Dataset reader for Posetrack2018."""
 
@@ -26,6 +38,7 @@ class Posetrack2018(torch.utils.data.Dataset):
         self.group = group
 
         self.preprocess = preprocess
+        self.annotation_files = annotation_files
         self.data_root = data_root
         self.only_annotated = only_annotated
         self.max_per_sequence = max_per_sequence
@@ -35,7 +48,7 @@ class Posetrack2018(torch.utils.data.Dataset):
         self.files = (
             spark_context
             .wholeTextFiles(annotation_files)
-            .mapValues(json.loads)
+            .mapValues(json_loads)
             .cache()
         )
         self.annotations = self.files.flatMap(self.group_annotations).collect()
@@ -134,6 +147,7 @@ class Posetrack2017(torch.utils.data.Dataset):
         self.group = group
 
         self.preprocess = preprocess
+        self.annotation_files = annotation_files
         self.data_root = data_root
         self.only_annotated = only_annotated
         self.max_per_sequence = max_per_sequence
@@ -143,7 +157,7 @@ class Posetrack2017(torch.utils.data.Dataset):
         self.files = (
             spark_context
             .wholeTextFiles(annotation_files)
-            .mapValues(json.loads)
+            .mapValues(json_loads)
             .cache()
         )
         self.annotations = self.files.flatMap(self.group_annotations).collect()
@@ -0,0 +1,97 @@
+"""Greedy occupancy NMS for the keypoints of all tracks in one frame.
+
+Same semantics as filling an openpifpaf.decoder.utils.Occupancy: a lookup
+clips to the reduced map and rounds down, a kept keypoint marks a square
+of half-width max(min_scale, joint_scale) / reduction.
+The loop is compiled with numba when it is installed.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _greedy_occupancy_nms_loop(data, joint_scales, occupancy, reduction, min_scale_reduced):
+    n_keypoints, height, width = occupancy.shape
+    for t in range(data.shape[0]):
+        for f in range(n_keypoints):
+            if data[t, f, 2] == 0.0:
+                continue
+
+            x = data[t, f, 0] / reduction
+            y = data[t, f, 1] / reduction
+            xi = int(min(max(x, 0.0), width - 1))
+            yi = int(min(max(y, 0.0), height - 1))
+            if occupancy[f, yi, xi]:
+                data[t, f, :] = 0.0
+                continue
+
+            sigma = max(min_scale_reduced, joint_scales[t, f] / reduction)
+            minx = min(max(int(x - sigma), 0), width - 1)
+            miny = min(max(int(y - sigma), 0), height - 1)
+            maxx = min(max(int(x + sigma) + 1, minx + 1), width)
+            maxy = min(max(int(y + sigma) + 1, miny + 1), height)
+            occupancy[f, miny:maxy, minx:maxx] = True
+
+
+def _greedy_occupancy_nms_numpy(data, joint_scales, occupancy, reduction, min_scale_reduced):
+    n_keypoints, height, width = occupancy.shape
+    keypoint_indices = np.arange(n_keypoints)
+    for t in range(data.shape[0]):
+        # keypoint types are independent, so one track is checked at once
+        x = data[t, :, 0] / reduction
+        y = data[t, :, 1] / reduction
+        xi = np.clip(x, 0, width - 1).astype(np.intp)
+        yi = np.clip(y, 0, height - 1).astype(np.intp)
+        taken = occupancy[keypoint_indices, yi, xi]
+        visible = data[t, :, 2] != 0.0
+        data[t, visible & taken] = 0.0
+
+        for f in np.flatnonzero(visible & ~taken):
+            sigma = max(min_scale_reduced, joint_scales[t, f] / reduction)
+            minx = min(max(int(x[f] - sigma), 0), width - 1)
+            miny = min(max(int(y[f] - sigma), 0), height - 1)
+            maxx = min(max(int(x[f] + sigma) + 1, minx + 1), width)
+            maxy = min(max(int(y[f] + sigma) + 1, miny + 1), height)
+            occupancy[f, miny:maxy, minx:maxx] = True
+
+
+if numba is not None:
+    _greedy_occupancy_nms = numba.njit(cache=True)(_greedy_occupancy_nms_loop)
+else:
+    _greedy_occupancy_nms = _greedy_occupancy_nms_numpy
+
+
+class OccupancyMap:
+    """Dense boolean occupancy map.
+
+    Exposes the occupancy and reduction attributes that the openpifpaf
+    occupancy visualizer reads.
+    """
+    def __init__(self, shape, reduction, *, min_scale):
+        self.reduction = reduction
+        self.min_scale = min_scale
+        self.occupancy = np.zeros((
+            shape[0],
+            int(shape[1] / reduction) + 1,
+            int(shape[2] / reduction) + 1,
+        ), dtype=np.bool_)
+
+    def __len__(self):
+        return len(self.occupancy)
+
+
+def greedy_occupancy_nms(data, joint_scales, occupied: OccupancyMap):
+    """Suppress keypoints in already occupied cells.
+
+    Tracks are processed in the given order. Suppressed keypoints are
+    zeroed in data (T, K, 3). Modifies data and the occupancy map in place.
+    """
+    assert data.shape[:2] == joint_scales.shape
+    assert data.shape[1] == len(occupied)
+    _greedy_occupancy_nms(data, joint_scales, occupied.occupancy,
+                          float(occupied.reduction),
+                          float(occupied.min_scale) / occupied.reduction)
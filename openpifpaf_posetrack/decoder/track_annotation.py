@@ -6,24 +6,20 @@ class TrackAnnotation:
 
     def __init__(self):
         self.frame_pose = []
+        self.last_frame = None
+        self._pose_by_frame = {}
 
         TrackAnnotation.track_id_counter += 1
         self.id_ = TrackAnnotation.track_id_counter
 
     def add(self, frame_number, pose_annotation):
         self.frame_pose.append((frame_number, pose_annotation))
+        self.last_frame = frame_number
+        self._pose_by_frame[frame_number] = pose_annotation
         return self
 
     def pose(self, frame_number):
-        for frame_i, pose in reversed(self.frame_pose):
-            if frame_i < frame_number:
-                break
-            if frame_i > frame_number:
-                continue
-
-            return pose
-
-        return None
+        return self._pose_by_frame.get(frame_number)
 
     def pose_score(self, frame_number):
         pose = self.pose(frame_number)
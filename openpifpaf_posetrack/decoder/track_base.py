@@ -98,7 +98,7 @@ class TrackBase(openpifpaf.decoder.Decoder):
             pa.ignore_region = any(pa_in_ca(pa, ca) for ca in crowd_annotations)
 
     def track_is_viable(self, track, frame_number):
-        if frame_number > track.frame_pose[-1][0] + 33:
+        if frame_number > track.last_frame + 33:
             return False
 
         if any(track.pose_score(frame_number - i) > self.multi_pose_threshold for i in range(33)):
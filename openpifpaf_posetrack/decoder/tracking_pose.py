@@ -1,4 +1,6 @@
 import argparse
+import copy
+import functools
 import logging
 import time
 
@@ -6,17 +8,30 @@ import numpy as np
 import openpifpaf
 
 from .. import headmeta, visualizer
+from .occupancy_nms import greedy_occupancy_nms, OccupancyMap
 from .track_annotation import TrackAnnotation
 from .track_base import TrackBase
 
 LOG = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=16)
+def tracking_skeleton_connections(skeleton, n_keypoints, n_frames):
+    """Single frame skeleton plus connections of each keypoint to itself in
+    the other frames of the cache group."""
+    return skeleton + tuple(
+        (keypoint_i + 1, keypoint_i + 1 + frame_i * n_keypoints)
+        for frame_i in range(1, n_frames)
+        for keypoint_i in range(n_keypoints)
+    )
+
+
 class TrackingPose(TrackBase):
     cache_group = [0, -1]
     forward_tracking_pose = True
     track_recovery = False
     single_seed = False
+    max_active = 200
 
     def __init__(self, cif_meta, caf_meta, tcaf_meta, *, pose_generator=None):
         super().__init__()
@@ -34,14 +49,8 @@ class TrackingPose(TrackBase):
         self.n_keypoints = len(cif_meta.keypoints)
         tracking_keypoints = cif_meta.keypoints * len(self.cache_group)
         tracking_sigmas = cif_meta.sigmas * len(self.cache_group)
-        tracking_skeleton = (
-            self.caf_meta.skeleton
-            + [
-                (keypoint_i + 1, keypoint_i + 1 + frame_i * self.n_keypoints)
-                for frame_i in range(1, len(self.cache_group))
-                for keypoint_i in range(self.n_keypoints)
-            ]
-        )
+        tracking_skeleton = list(tracking_skeleton_connections(
+            tuple(map(tuple, self.caf_meta.skeleton)), self.n_keypoints, len(self.cache_group)))
 
         self.tracking_cif_meta = openpifpaf.headmeta.Cif(
             'tracking_cif', cif_meta.dataset,
@@ -64,12 +73,23 @@ class TrackingPose(TrackBase):
 
         self.pose_generator = pose_generator or openpifpaf.decoder.CifCaf(
             [self.tracking_cif_meta], [self.tracking_caf_meta])
+        # Override on the instance only. Tracking has its own soft NMS and
+        # the other CifCaf decoders keep their configured values.
+        self.pose_generator.nms = None
+        self.pose_generator.keypoint_threshold = 0.001
         LOG.debug('keypoint threshold: cifcaf=%f, nms=%f, %s',
-                  openpifpaf.decoder.CifCaf.keypoint_threshold,
+                  self.pose_generator.keypoint_threshold,
                   openpifpaf.decoder.utils.nms.Keypoints.keypoint_threshold,
-                  openpifpaf.decoder.CifCaf.nms)
+                  self.pose_generator.nms)
 
         self.vis_multitracking = visualizer.MultiTracking(self.tracking_caf_meta)
+        self._tracking_caf_buffer = None
+
+        # templates for the annotations created in every frame
+        self._tracking_ann_template = openpifpaf.Annotation(
+            self.tracking_cif_meta.keypoints, self.tracking_caf_meta.skeleton)
+        self._single_ann_template = openpifpaf.Annotation(
+            self.cif_meta.keypoints, self.caf_meta.skeleton)
 
     @classmethod
     def cli(cls, parser: argparse.ArgumentParser):
@@ -78,11 +98,15 @@ class TrackingPose(TrackBase):
         group.add_argument('--trackingpose-track-recovery', default=False, action='store_true')
         assert not cls.single_seed
         group.add_argument('--trackingpose-single-seed', default=False, action='store_true')
+        group.add_argument('--trackingpose-max-active', default=cls.max_active, type=int,
+                           help='maximum number of active tracks, keeps the best scoring')
 
     @classmethod
     def configure(cls, args: argparse.Namespace):
         cls.track_recovery = args.trackingpose_track_recovery
         cls.single_seed = args.trackingpose_single_seed
+        assert args.trackingpose_max_active > 0
+        cls.max_active = args.trackingpose_max_active
 
     @classmethod
     def factory(cls, head_metas):
@@ -97,6 +121,31 @@ class TrackingPose(TrackBase):
                 and isinstance(tcaf_meta, headmeta.Tcaf))
         ]
 
+    @staticmethod
+    def annotation_from_template(template, data, joint_scales):
+        """Shallow copy of template with its own data and mutable state."""
+        ann = copy.copy(template)
+        ann.data = data
+        ann.joint_scales = joint_scales
+        ann.score_weights = template.score_weights.copy()
+        ann.decoding_order = []
+        ann.frontier_order = []
+        return ann
+
+    def tracking_caf_field(self, caf_field, tcaf_field):
+        """Concatenate caf and tcaf fields into a buffer that is reused across frames."""
+        shape = (caf_field.shape[0] + tcaf_field.shape[0],) + caf_field.shape[1:]
+        dtype = np.result_type(caf_field, tcaf_field)
+        if (self._tracking_caf_buffer is None
+                or self._tracking_caf_buffer.shape != shape
+                or self._tracking_caf_buffer.dtype != dtype):
+            self._tracking_caf_buffer = np.empty(shape, dtype=dtype)
+
+        n_caf = caf_field.shape[0]
+        np.copyto(self._tracking_caf_buffer[:n_caf], caf_field)
+        np.copyto(self._tracking_caf_buffer[n_caf:], tcaf_field)
+        return self._tracking_caf_buffer
+
     def soft_nms(self, tracks, frame_number):
         if not tracks:
             return
@@ -110,44 +159,34 @@ class TrackingPose(TrackBase):
             kps[kps[:, 2] < openpifpaf.decoder.utils.nms.Keypoints.keypoint_threshold] = 0.0
             kps[self.invalid_keypoints] = 0.0
 
-        occupied = openpifpaf.decoder.utils.Occupancy((
+        last_poses = np.stack([t.frame_pose[-1][1].data for t in tracks])
+        max_x, max_y = np.max(last_poses[:, :, :2], axis=(0, 1))
+        occupied = OccupancyMap((
             self.n_keypoints,
-            int(max(1, max(np.max(t.frame_pose[-1][1].data[:, 1]) for t in tracks) + 1)),
-            int(max(1, max(np.max(t.frame_pose[-1][1].data[:, 0]) for t in tracks) + 1)),
+            int(max(1, max_y + 1)),
+            int(max(1, max_x + 1)),
         ), 2, min_scale=4)
         LOG.debug('occupied shape = %s', occupied.occupancy.shape)
 
-        tracks = sorted(tracks, key=lambda tr: -tr.score(frame_number, current_importance=0.01))
-        for track in tracks:
-            ann = track.pose(frame_number)
-            if ann is None:
-                continue
-
-            assert ann.joint_scales is not None
-            assert len(occupied) == len(ann.data)
-            for f, (xyv, joint_s) in enumerate(zip(ann.data, ann.joint_scales)):
-                v = xyv[2]
-                if v == 0.0:
-                    continue
-
-                if occupied.get(f, xyv[0], xyv[1]):
-                    xyv[2] = 0.0
-                else:
-                    occupied.set(f, xyv[0], xyv[1], joint_s)
-
-        # keypoint threshold
-        for t in tracks:
-            frame_ann = t.pose(self.frame_number)
-            if frame_ann is None:
-                continue
-            kps = frame_ann.data
-            kps[kps[:, 2] < openpifpaf.decoder.utils.nms.Keypoints.keypoint_threshold] = 0.0
+        scores = np.fromiter(
+            (t.score(frame_number, current_importance=0.01) for t in tracks),
+            dtype=np.float64, count=len(tracks))
+        tracks = [tracks[i] for i in np.argsort(-scores, kind='stable')]
+        anns = [t.pose(frame_number) for t in tracks]
+        anns = [ann for ann in anns if ann is not None]
+        if anns:
+            assert all(ann.joint_scales is not None for ann in anns)
+            data = np.stack([ann.data for ann in anns])
+            joint_scales = np.stack([ann.joint_scales for ann in anns])
+            greedy_occupancy_nms(data, joint_scales, occupied)
+            for ann, ann_data in zip(anns, data):
+                ann.data[:] = ann_data
 
         if self.pose_generator.occupancy_visualizer is not None:
             LOG.debug('Occupied fields after NMS')
             self.pose_generator.occupancy_visualizer.predicted(occupied)
 
-    # pylint: disable=too-many-statements
+    # pylint: disable=too-many-branches,too-many-statements
     def __call__(self, fields, *, initial_annotations=None):
         self.frame_number += 1
 
@@ -156,60 +195,62 @@ class TrackingPose(TrackBase):
         start = time.perf_counter()
 
         # initialize tracking poses from self.active tracks
-        initial_annotations = []
-        for track in self.active:
-            tracking_ann = openpifpaf.Annotation(
-                self.tracking_cif_meta.keypoints,
-                self.tracking_caf_meta.skeleton,
-            )
-            tracking_ann.id_ = track.id_
-            for position_i, frame_i in enumerate(self.cache_group[1:], start=1):
+        n_tracking_keypoints = len(self.tracking_cif_meta.keypoints)
+        tracking_data = np.zeros((len(self.active), n_tracking_keypoints, 3), dtype=np.float32)
+        tracking_scales = np.zeros((len(self.active), n_tracking_keypoints), dtype=np.float32)
+        for position_i, frame_i in enumerate(self.cache_group[1:], start=1):
+            position_slice = slice(self.n_keypoints * position_i,
+                                   self.n_keypoints * position_i + self.n_keypoints)
+            has_pose = np.zeros((len(self.active),), dtype=bool)
+            for track_i, track in enumerate(self.active):
                 prev_pose = track.pose(self.frame_number + frame_i)
-                if prev_pose is not None:
-                    tracking_ann.data[
-                        self.n_keypoints * position_i:
-                        self.n_keypoints * position_i + self.n_keypoints
-                    ] = prev_pose.data
-                    tracking_ann.joint_scales[
-                        self.n_keypoints * position_i:
-                        self.n_keypoints * position_i + self.n_keypoints
-                    ] = prev_pose.joint_scales
-
-                    if self.single_seed:
-                        inverse_mask = tracking_ann.data[:, 2] < np.amax(tracking_ann.data[:, 2])
-                        tracking_ann.data[inverse_mask] = 0.0
-                        tracking_ann.joint_scales[inverse_mask] = 0.0
-
-            tracking_ann.data[tracking_ann.data[:, 2] < 0.05] = 0.0
-            if not np.any(tracking_ann.data[:, 2] > 0.0):
-                continue
+                if prev_pose is None:
+                    continue
+                tracking_data[track_i, position_slice] = prev_pose.data
+                tracking_scales[track_i, position_slice] = prev_pose.joint_scales
+                has_pose[track_i] = True
+
+            if self.single_seed:
+                inverse_mask = (
+                    tracking_data[:, :, 2]
+                    < np.amax(tracking_data[:, :, 2], axis=1, keepdims=True)
+                )
+                inverse_mask &= has_pose[:, np.newaxis]
+                tracking_data[inverse_mask] = 0.0
+                tracking_scales[inverse_mask] = 0.0
+
+        tracking_data[tracking_data[:, :, 2] < 0.05] = 0.0
+        initial_annotations = []
+        for track_i in np.flatnonzero(np.any(tracking_data[:, :, 2] > 0.0, axis=1)):
+            # views into the per-frame blocks, which are not reused
+            tracking_ann = self.annotation_from_template(
+                self._tracking_ann_template, tracking_data[track_i], tracking_scales[track_i])
+            tracking_ann.id_ = self.active[track_i].id_
             initial_annotations.append(tracking_ann)
 
         LOG.debug('using %d initial annotations', len(initial_annotations))
 
         # use standard pose processor to connect to current frame
-        LOG.debug('overwriting CifCaf parameters')
-        openpifpaf.decoder.CifCaf.nms = None
-        openpifpaf.decoder.CifCaf.keypoint_threshold = 0.001
         tracking_fields = [
             fields[self.cif_meta.head_index],
-            np.concatenate([
-                fields[self.caf_meta.head_index],
-                fields[self.tcaf_meta.head_index],
-            ], axis=0)
+            self.tracking_caf_field(fields[self.caf_meta.head_index],
+                                    fields[self.tcaf_meta.head_index]),
         ]
         tracking_annotations = self.pose_generator(
             tracking_fields, initial_annotations=initial_annotations)
 
         # extract new pose annotations from tracking pose
-        active_by_id = {t.id_: t for t in self.active}
+        # built on first use as many frames only start new tracks
+        active_by_id = None
         lost_trackids = {t.id_: t.frame_pose[-1][0] for t in self.active
                          if t.frame_pose[-1][0] < self.frame_number - 1}
         for tracking_ann in tracking_annotations:
-            single_frame_ann = openpifpaf.Annotation(
-                self.cif_meta.keypoints, self.caf_meta.skeleton)
-            single_frame_ann.data[:] = tracking_ann.data[:self.n_keypoints]
-            single_frame_ann.joint_scales = tracking_ann.joint_scales[:self.n_keypoints]
+            # CifCaf can produce float64 joint scales; keep track poses float32
+            single_frame_ann = self.annotation_from_template(
+                self._single_ann_template,
+                np.array(tracking_ann.data[:self.n_keypoints], dtype=np.float32),
+                tracking_ann.joint_scales[:self.n_keypoints].astype(np.float32, copy=False),
+            )
 
             track_id = getattr(tracking_ann, 'id_', -1)
             if track_id == -1:
@@ -218,6 +259,8 @@ class TrackingPose(TrackBase):
                 # assign new track id also to tracking pose for visualization
                 tracking_ann.id_ = new_track.id_
                 continue
+            if active_by_id is None:
+                active_by_id = {t.id_: t for t in self.active}
             active_by_id[track_id].add(self.frame_number, single_frame_ann)
 
         # nms tracks
@@ -237,6 +280,8 @@ class TrackingPose(TrackBase):
                 track_id = max(lost_trackids.items(), key=lambda d: d[1])[0]
                 del lost_trackids[track_id]
                 # tracking_ann.id_ = track_id
+                if active_by_id is None:
+                    active_by_id = {t.id_: t for t in self.active}
                 active_by_id[track_id].add(self.frame_number, track.pose(self.frame_number))
                 removed.add(track)
                 LOG.info('recovered track %d', track_id)
@@ -248,12 +293,20 @@ class TrackingPose(TrackBase):
 
         # pruning lost tracks
         self.active = [t for t in self.active if self.track_is_viable(t, self.frame_number)]
+        if len(self.active) > self.max_active:
+            LOG.warning('evicting %d of %d active tracks',
+                        len(self.active) - self.max_active, len(self.active))
+            scores = np.fromiter((t.score(self.frame_number) for t in self.active),
+                                 dtype=np.float64, count=len(self.active))
+            keep = np.sort(np.argsort(-scores, kind='stable')[:self.max_active])
+            self.active = [self.active[i] for i in keep]
 
         good_track_ids = {t.id_ for t in self.active if self.track_is_good(t, self.frame_number)}
-        LOG.info('active tracks = %d, good = %d, track ids = %s',
-                 len(self.active), len(good_track_ids),
-                 [self.simplified_track_id_map.get(t.id_, t.id_)
-                  for t in self.active])
+        if LOG.isEnabledFor(logging.INFO):
+            LOG.info('active tracks = %d, good = %d, track ids = %s',
+                     len(self.active), len(good_track_ids),
+                     [self.simplified_track_id_map.get(t.id_, t.id_)
+                      for t in self.active])
 
         # visualize good tracking poses with assigned track id
         good_track_annotations = [t for t in tracking_annotations if t.id_ in good_track_ids]
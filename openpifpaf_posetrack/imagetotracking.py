@@ -48,7 +48,7 @@ def main():
         'meta': {
             'image-source': args.checkpoint,
         },
-    }, args.output)
+    }, args.output, _use_new_zipfile_serialization=True)
 
 
 if __name__ == '__main__':
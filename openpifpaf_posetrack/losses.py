@@ -0,0 +1,22 @@
+import argparse
+
+import openpifpaf
+
+
+class CompositeLoss(openpifpaf.network.losses.CompositeLoss):
+    """Composite loss that accepts reduced precision targets.
+
+    Targets can be stored as float16 to reduce the data loader traffic
+    (see --posetrack-target-dtype). They are upcast to the dtype of the
+    predictions before the loss is computed.
+    """
+    @classmethod
+    def cli(cls, parser: argparse.ArgumentParser):
+        # The options are added by the parent class, which is registered
+        # for the coco heads. The inherited configure() reads them.
+        pass
+
+    def forward(self, x, t):
+        if t is not None and t.dtype != x.dtype:
+            t = t.to(x.dtype)
+        return super().forward(x, t)
@@ -50,15 +50,16 @@ class Posetrack2017(openpifpaf.datasets.DataModule):
                              draw_skeleton=SKELETON,
                              only_in_field_of_view=True)
 
-        cif.upsample_stride = Posetrack2018.upsample_stride
-        caf.upsample_stride = Posetrack2018.upsample_stride
-        dcaf.upsample_stride = Posetrack2018.upsample_stride
-        tcaf.upsample_stride = Posetrack2018.upsample_stride
         self.head_metas = [cif, caf, dcaf, tcaf]
+        for hm in self.head_metas:
+            hm.upsample_stride = Posetrack2018.upsample_stride
 
         if Posetrack2018.ablation_without_tcaf:
             self.head_metas = [cif, caf, dcaf]
 
+        self._preprocess_cache = {}
+        self._eval_data = None
+
     @classmethod
     def cli(cls, parser: argparse.ArgumentParser):
         group = parser.add_argument_group('data module Posetrack2017')
@@ -140,6 +141,15 @@ class Posetrack2017(openpifpaf.datasets.DataModule):
     #         collate_fn=collate.collate_tracking_images_targets_meta)
 
     def _eval_preprocess(self):
+        # the eval configuration is taken from Posetrack2018
+        key = ('eval', Posetrack2018.eval_long_edge, Posetrack2018.eval_extended_scale,
+               Posetrack2018.eval_orientation_invariant, Posetrack2018.batch_size,
+               tuple(id(m) for m in self.head_metas))
+        if key not in self._preprocess_cache:
+            self._preprocess_cache[key] = self._build_eval_preprocess()
+        return self._preprocess_cache[key]
+
+    def _build_eval_preprocess(self):
         return openpifpaf.transforms.Compose([
             *Posetrack2018.common_eval_preprocess(),
             openpifpaf.transforms.ToAnnotations([
@@ -153,24 +163,30 @@ class Posetrack2017(openpifpaf.datasets.DataModule):
             openpifpaf.transforms.EVAL_TRANSFORM,
         ])
 
+    def _eval_dataset(self):
+        """Eval dataset shared by metrics() and eval_loader()."""
+        if self._eval_data is None \
+           or self._eval_data.annotation_files != self.eval_annotations \
+           or self._eval_data.data_root != self.data_root:
+            self._eval_data = datasets.Posetrack2017(
+                annotation_files=self.eval_annotations,
+                data_root=self.data_root,
+                preprocess=None,
+            )
+        return self._eval_data
+
     def eval_loader(self):
-        eval_data = datasets.Posetrack2017(
-            annotation_files=self.eval_annotations,
-            data_root=self.data_root,
-            preprocess=self._eval_preprocess(),
-        )
+        eval_data = self._eval_dataset()
+        eval_data.preprocess = self._eval_preprocess()
         eval_loader = torch.utils.data.DataLoader(
             eval_data, batch_size=self.batch_size, shuffle=False,
             pin_memory=self.pin_memory, num_workers=self.loader_workers, drop_last=False,
-            collate_fn=openpifpaf.datasets.collate_images_anns_meta)
+            collate_fn=openpifpaf.datasets.collate_images_anns_meta,
+            **Posetrack2018.worker_kwargs(self.loader_workers))
         return LoaderWithReset(eval_loader, 'annotation_file')
 
     def metrics(self):
-        eval_data = datasets.Posetrack2017(
-            annotation_files=self.eval_annotations,
-            data_root=self.data_root,
-            preprocess=self._eval_preprocess(),
-        )
+        eval_data = self._eval_dataset()
         return [metric.Posetrack(
             images=eval_data.meta_images(),
             categories=eval_data.meta_categories(),
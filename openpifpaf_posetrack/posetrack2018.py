@@ -1,5 +1,8 @@
 import argparse
+import functools
+import logging
 
+import PIL
 import torch
 
 import openpifpaf
@@ -16,6 +19,8 @@ from .constants import (
     DENSER_CONNECTIONS,
 )
 
+LOG = logging.getLogger(__name__)
+
 
 class Posetrack2018(openpifpaf.datasets.DataModule):
     # cli configurable
@@ -31,6 +36,7 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
     min_kp_anns = 1
     bmin = 0.1
     sample_pairing = False
+    albumentations = False
 
     eval_long_edge = 801
     eval_orientation_invariant = 0.0
@@ -38,6 +44,12 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
 
     ablation_without_tcaf = False
 
+    persistent_workers = True
+    prefetch_factor = 4
+    target_dtype = 'float32'
+    channels_last = False
+    target_cache = None
+
     def __init__(self):
         super().__init__()
 
@@ -65,15 +77,16 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
                              draw_skeleton_single_frame=SKELETON,
                              only_in_field_of_view=True)
 
-        cif.upsample_stride = self.upsample_stride
-        caf.upsample_stride = self.upsample_stride
-        dcaf.upsample_stride = self.upsample_stride
-        tcaf.upsample_stride = self.upsample_stride
         self.head_metas = [cif, caf, dcaf, tcaf]
+        for hm in self.head_metas:
+            hm.upsample_stride = self.upsample_stride
 
         if self.ablation_without_tcaf:
             self.head_metas = [cif, caf, dcaf]
 
+        self._preprocess_cache = {}
+        self._eval_data = None
+
     @classmethod
     def cli(cls, parser: argparse.ArgumentParser):
         group2018 = parser.add_argument_group('data module Posetrack2018')
@@ -111,6 +124,10 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
         group.add_argument('--posetrack-bmin', default=cls.bmin, type=float)
         group.add_argument('--posetrack-sample-pairing',
                            default=False, action='store_true')
+        assert not cls.albumentations
+        group.add_argument('--posetrack-albumentations',
+                           default=False, action='store_true',
+                           help='use Albumentations for color augmentations')
 
         group.add_argument('--posetrack-eval-long-edge', default=cls.eval_long_edge, type=int)
         assert not cls.eval_extended_scale
@@ -120,6 +137,25 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
 
         group.add_argument('--ablation-without-tcaf', default=False, action='store_true')
 
+        assert cls.persistent_workers
+        group.add_argument('--posetrack-no-persistent-workers',
+                           dest='posetrack_persistent_workers',
+                           default=True, action='store_false',
+                           help='re-create loader workers at every epoch')
+        group.add_argument('--posetrack-prefetch-factor',
+                           default=cls.prefetch_factor, type=int,
+                           help='number of batches loaded in advance by each worker')
+        group.add_argument('--posetrack-target-dtype',
+                           default=cls.target_dtype, choices=('float32', 'float16'),
+                           help='dtype of training targets between loader and loss')
+        assert not cls.channels_last
+        group.add_argument('--posetrack-channels-last',
+                           default=False, action='store_true',
+                           help='collate training images in channels-last memory format')
+        group.add_argument('--posetrack-target-cache', default=cls.target_cache,
+                           help=('cache training targets in this directory '
+                                 '(requires --posetrack-no-augmentation)'))
+
     @classmethod
     def configure(cls, args: argparse.Namespace):
         # extract global information
@@ -140,6 +176,7 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
         cls.min_kp_anns = args.posetrack_min_kp_anns
         cls.bmin = args.posetrack_bmin
         cls.sample_pairing = args.posetrack_sample_pairing
+        cls.albumentations = args.posetrack_albumentations
 
         # evaluation
         cls.eval_long_edge = args.posetrack_eval_long_edge
@@ -149,7 +186,48 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
         # ablation
         cls.ablation_without_tcaf = args.ablation_without_tcaf
 
+        # loader workers
+        cls.persistent_workers = args.posetrack_persistent_workers
+        cls.prefetch_factor = args.posetrack_prefetch_factor
+        cls.target_dtype = args.posetrack_target_dtype
+        cls.channels_last = args.posetrack_channels_last
+        cls.target_cache = args.posetrack_target_cache
+        assert not (cls.target_cache and cls.augmentation), \
+            'target cache requires --posetrack-no-augmentation'
+
+    @classmethod
+    def worker_kwargs(cls, loader_workers):
+        """Extra DataLoader arguments that are only valid with worker processes."""
+        if not loader_workers:
+            return {}
+        return {
+            'persistent_workers': cls.persistent_workers,
+            'prefetch_factor': cls.prefetch_factor,
+        }
+
+    @classmethod
+    def tracking_collate(cls):
+        return functools.partial(collate.collate_tracking_images_targets_meta,
+                                 channels_last=cls.channels_last)
+
+    @classmethod
+    def target_torch_dtype(cls):
+        if cls.target_dtype == 'float32':
+            return None  # encoders already produce float32
+        return getattr(torch, cls.target_dtype)
+
     def _preprocess(self):
+        # the configuration can change between calls through configure() and
+        # head metas can be replaced when loading a checkpoint
+        key = ('train', self.square_edge, self.bmin, self.augmentation,
+               self.sample_pairing, self.albumentations, self.ablation_without_tcaf,
+               self.target_dtype, self.target_cache,
+               tuple(id(m) for m in self.head_metas))
+        if key not in self._preprocess_cache:
+            self._preprocess_cache[key] = self._build_preprocess()
+        return self._preprocess_cache[key]
+
+    def _build_preprocess(self):
         encoders = [
             encoder.SingleImage(openpifpaf.encoder.Cif(self.head_metas[0], bmin=self.bmin)),
             encoder.SingleImage(openpifpaf.encoder.Caf(self.head_metas[1], bmin=self.bmin)),
@@ -158,9 +236,20 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
         if not self.ablation_without_tcaf:
             encoders.append(encoder.Tcaf(self.head_metas[3], bmin=self.bmin))
 
+        if self.target_cache:
+            salt = repr((
+                self.square_edge, self.bmin, self.target_dtype,
+                [(m.name, m.dataset, m.stride) for m in self.head_metas],
+            ))
+            encoders_t = transforms.CachedEncoders(
+                encoders, self.target_cache,
+                salt=salt, target_dtype=self.target_torch_dtype())
+        else:
+            encoders_t = transforms.Encoders(encoders, target_dtype=self.target_torch_dtype())
+
         return openpifpaf.transforms.Compose([
             *self.common_preprocess(),
-            transforms.Encoders(encoders),
+            encoders_t,
         ])
 
     @classmethod
@@ -177,6 +266,10 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
         if cls.sample_pairing:
             sample_pairing_t = transforms.SamplePairing()
 
+        train_t = openpifpaf.transforms.TRAIN_TRANSFORM
+        if cls.albumentations:
+            train_t = transforms.AlbumentationsAdapter.train_transform()
+
         hflip_posetrack = openpifpaf.transforms.HFlip(
             KEYPOINTS,
             openpifpaf.plugins.coco.constants.HFLIP)
@@ -195,10 +288,28 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
             transforms.Crop(cls.square_edge, max_shift=30.0),
             transforms.Pad(cls.square_edge, max_shift=30.0),
             sample_pairing_t,
-            S(openpifpaf.transforms.TRAIN_TRANSFORM),
+            S(train_t),
         ]
 
+    @property
+    def tracking_batch_size(self):
+        # to keep base-net batch size equal across batches, train tracking with
+        # half the batch-size of single-image datasets
+        assert self.batch_size % 2 == 0
+        return self.batch_size // 2
+
+    @staticmethod
+    def _check_pillow_simd():
+        # Pillow-SIMD is versioned like the Pillow release it is based on
+        # with an additional .postN suffix
+        if '.post' not in PIL.__version__:
+            LOG.warning('data augmentation is faster with Pillow-SIMD (installed: Pillow %s)',
+                        PIL.__version__)
+
     def train_loader(self):
+        if self.augmentation:
+            self._check_pillow_simd()
+
         train_data = datasets.Posetrack2018(
             annotation_files=self.train_annotations,
             data_root=self.data_root,
@@ -207,13 +318,11 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
             only_annotated=True,
         )
 
-        # to keep base-net batch size equal across batches, train tracking with
-        # half the batch-size of single-image datasets
-        assert self.batch_size % 2 == 0
         return torch.utils.data.DataLoader(
-            train_data, batch_size=self.batch_size // 2, shuffle=not self.debug,
+            train_data, batch_size=self.tracking_batch_size, shuffle=not self.debug,
             pin_memory=self.pin_memory, num_workers=self.loader_workers, drop_last=True,
-            collate_fn=collate.collate_tracking_images_targets_meta)
+            collate_fn=self.tracking_collate(),
+            **self.worker_kwargs(self.loader_workers))
 
     def val_loader(self):
         val_data = datasets.Posetrack2018(
@@ -224,13 +333,11 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
             only_annotated=True,
         )
 
-        # to keep base-net batch size equal across batches, train tracking with
-        # half the batch-size of single-image datasets
-        assert self.batch_size % 2 == 0
         return torch.utils.data.DataLoader(
-            val_data, batch_size=self.batch_size // 2, shuffle=not self.debug,
+            val_data, batch_size=self.tracking_batch_size, shuffle=not self.debug,
             pin_memory=self.pin_memory, num_workers=self.loader_workers, drop_last=True,
-            collate_fn=collate.collate_tracking_images_targets_meta)
+            collate_fn=self.tracking_collate(),
+            **self.worker_kwargs(self.loader_workers))
 
     @classmethod
     def common_eval_preprocess(cls):
@@ -270,6 +377,14 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
         ]
 
     def _eval_preprocess(self):
+        key = ('eval', self.eval_long_edge, self.eval_extended_scale,
+               self.eval_orientation_invariant, self.batch_size,
+               tuple(id(m) for m in self.head_metas))
+        if key not in self._preprocess_cache:
+            self._preprocess_cache[key] = self._build_eval_preprocess()
+        return self._preprocess_cache[key]
+
+    def _build_eval_preprocess(self):
         return openpifpaf.transforms.Compose([
             *self.common_eval_preprocess(),
             openpifpaf.transforms.ToAnnotations([
@@ -283,24 +398,30 @@ class Posetrack2018(openpifpaf.datasets.DataModule):
             openpifpaf.transforms.EVAL_TRANSFORM,
         ])
 
+    def _eval_dataset(self):
+        """Eval dataset shared by metrics() and eval_loader()."""
+        if self._eval_data is None \
+           or self._eval_data.annotation_files != self.eval_annotations \
+           or self._eval_data.data_root != self.data_root:
+            self._eval_data = datasets.Posetrack2018(
+                annotation_files=self.eval_annotations,
+                data_root=self.data_root,
+                preprocess=None,
+            )
+        return self._eval_data
+
     def eval_loader(self):
-        eval_data = datasets.Posetrack2018(
-            annotation_files=self.eval_annotations,
-            data_root=self.data_root,
-            preprocess=self._eval_preprocess(),
-        )
+        eval_data = self._eval_dataset()
+        eval_data.preprocess = self._eval_preprocess()
         eval_loader = torch.utils.data.DataLoader(
             eval_data, batch_size=self.batch_size, shuffle=False,
             pin_memory=self.pin_memory, num_workers=self.loader_workers, drop_last=False,
-            collate_fn=openpifpaf.datasets.collate_images_anns_meta)
+            collate_fn=openpifpaf.datasets.collate_images_anns_meta,
+            **self.worker_kwargs(self.loader_workers))
         return LoaderWithReset(eval_loader, 'annotation_file')
 
     def metrics(self):
-        eval_data = datasets.Posetrack2018(
-            annotation_files=self.eval_annotations,
-            data_root=self.data_root,
-            preprocess=self._eval_preprocess(),
-        )
+        eval_data = self._eval_dataset()
         return [metric.Posetrack(
             images=eval_data.meta_images(),
             categories=eval_data.meta_categories(),
@@ -318,8 +439,8 @@ class LoaderWithReset:
     def __iter__(self):
         for images, anns, metas in self.parent:
             value = metas[0][self.key_to_monitor]
-            if len(metas) >= 2:
-                assert all(m[self.key_to_monitor] == value for m in metas[1:])
+            # assert statements are skipped when running with python -O
+            assert len({m[self.key_to_monitor] for m in metas}) == 1
 
             if value != self.previous_value:
                 Signal.emit('eval_reset')
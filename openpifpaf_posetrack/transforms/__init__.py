@@ -2,8 +2,8 @@ from .blank_past import BlankPast, PreviousPast, RandomizeOneFrame
 from .camera_shift import CameraShift
 from .crop import Crop
 from .deinterlace import Deinterlace
-from .encoders import Encoders
-from .image import HorizontalBlur
+from .encoders import CachedEncoders, Encoders
+from .image import AlbumentationsAdapter, HorizontalBlur
 from .image_to_tracking import ImageToTracking
 from .impute import AddCrowdForIncompleteHead
 from .normalize import NormalizeCocoToMpii, NormalizeMOT, NormalizePosetrack
@@ -1,12 +1,63 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+import torch
+
 import openpifpaf
 
+LOG = logging.getLogger(__name__)
+
 
 class Encoders(openpifpaf.transforms.Preprocess):
-    def __init__(self, encoders):
+    def __init__(self, encoders, *, target_dtype=None):
         self.encoders = encoders
+        self.target_dtype = target_dtype
 
     def __call__(self, images, all_anns, metas):
         targets = [enc(images, all_anns, metas) for enc in self.encoders]
+        if self.target_dtype is not None:
+            targets = [t.to(self.target_dtype) for t in targets]
         meta = metas[0]
         meta['head_indices'] = [enc.meta.head_index for enc in self.encoders]
         return images, targets, meta
+
+
+class CachedEncoders(Encoders):
+    """Encoders with targets cached on disk.
+
+    Only valid for deterministic preprocessing (without augmentation).
+    The salt has to change whenever a setting that affects the targets
+    changes. Cached targets are memory mapped copy-on-write.
+    """
+    def __init__(self, encoders, cache_dir, *, salt='', target_dtype=None):
+        super().__init__(encoders, target_dtype=target_dtype)
+        self.cache_dir = cache_dir
+        self.salt = salt
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_files(self, metas):
+        key = '|'.join([self.salt] + [m['file_name'] for m in metas])
+        digest = hashlib.blake2b(key.encode('utf8'), digest_size=16).hexdigest()
+        return [os.path.join(self.cache_dir, '{}-{}.npy'.format(digest, i))
+                for i, _ in enumerate(self.encoders)]
+
+    def __call__(self, images, all_anns, metas):
+        cache_files = self.cache_files(metas)
+        if all(os.path.exists(f) for f in cache_files):
+            LOG.debug('loading targets from %s', cache_files[0])
+            targets = [torch.from_numpy(np.load(f, mmap_mode='c')) for f in cache_files]
+            meta = metas[0]
+            meta['head_indices'] = [enc.meta.head_index for enc in self.encoders]
+            return images, targets, meta
+
+        images, targets, meta = super().__call__(images, all_anns, metas)
+        for target, cache_file in zip(targets, cache_files):
+            # write to a temporary file first as other workers might read
+            tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.save(f, target.numpy())
+            os.replace(tmp_file, cache_file)
+        return images, targets, meta
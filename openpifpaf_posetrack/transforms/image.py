@@ -7,6 +7,11 @@ import torch
 
 import openpifpaf
 
+try:
+    import albumentations
+except ImportError:
+    albumentations = None
+
 LOG = logging.getLogger(__name__)
 
 
@@ -20,3 +25,40 @@ class HorizontalBlur(openpifpaf.transforms.Preprocess):
         LOG.debug('horizontal blur with %f', sigma)
         im_np = scipy.ndimage.filters.gaussian_filter1d(im_np, sigma=sigma, axis=1)
         return PIL.Image.fromarray(im_np), anns, meta
+
+
+class AlbumentationsAdapter(openpifpaf.transforms.Preprocess):
+    """Apply an Albumentations transform to the image.
+
+    Annotations and meta are passed through unchanged so only pixel-level
+    transforms that keep the image geometry are valid here.
+    Albumentations uses its own random state. It is reseeded from torch
+    for every image so that the frames of a tracking group, which run
+    under the same forked torch RNG, get the same augmentation.
+    """
+    def __init__(self, transform):
+        self.transform = transform
+
+    def __call__(self, image, anns, meta):
+        self.transform.set_random_seed(int(torch.randint(0, 2**31 - 1, (1,)).item()))
+        im_np = np.asarray(image)
+        im_np = self.transform(image=im_np)['image']
+        return PIL.Image.fromarray(im_np), anns, meta
+
+    @classmethod
+    def train_transform(cls):
+        """Equivalent of openpifpaf.transforms.TRAIN_TRANSFORM."""
+        if albumentations is None:
+            raise ImportError('albumentations is not installed, '
+                              'install openpifpaf_posetrack[albumentations]')
+
+        return openpifpaf.transforms.Compose([
+            openpifpaf.transforms.NormalizeAnnotations(),
+            cls(albumentations.Compose([
+                albumentations.ColorJitter(
+                    brightness=0.4, contrast=0.1, saturation=0.4, hue=0.1, p=1.0),
+                albumentations.ImageCompression(quality_range=(50, 50), p=0.1),
+                albumentations.ToGray(p=0.01),
+            ])),
+            openpifpaf.transforms.EVAL_TRANSFORM,
+        ])
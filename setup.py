@@ -30,6 +30,10 @@ setup(
         ],
         'train': [
             'motmetrics',
+            'orjson',
+        ],
+        'albumentations': [
+            'albumentations>=2.0,<3',
         ],
         'video': [
             'opencv-python',
@@ -0,0 +1,53 @@
+import numpy as np
+import openpifpaf
+import pytest
+
+from openpifpaf_posetrack.decoder import occupancy_nms
+
+
+def reference_nms(data, joint_scales, shape):
+    occupied = openpifpaf.decoder.utils.Occupancy(shape, 2, min_scale=4)
+    for ann_data, ann_scales in zip(data, joint_scales):
+        for f, (xyv, scale) in enumerate(zip(ann_data, ann_scales)):
+            if xyv[2] == 0.0:
+                continue
+            if occupied.get(f, xyv[0], xyv[1]):
+                xyv[:] = 0.0
+            else:
+                occupied.set(f, xyv[0], xyv[1], scale)
+    return occupied.occupancy
+
+
+def random_tracks(rng, n_tracks, n_keypoints, size):
+    # coordinates on a 1/8 grid are exact in float32 and float64 and
+    # include negative and out-of-range values to exercise the clipping
+    data = np.zeros((n_tracks, n_keypoints, 3), dtype=np.float32)
+    center = rng.uniform(0, size, (n_tracks, 1, 2))
+    xy = center + rng.normal(0, 0.3 * size, (n_tracks, n_keypoints, 2))
+    data[:, :, :2] = np.round(xy * 8.0) / 8.0
+    data[:, :, 2] = rng.uniform(0.1, 1.0, (n_tracks, n_keypoints))
+    data[rng.uniform(size=(n_tracks, n_keypoints)) < 0.2, 2] = 0.0
+    joint_scales = np.round(rng.uniform(0, 16, (n_tracks, n_keypoints)) * 4.0) / 4.0
+    return data, joint_scales.astype(np.float32)
+
+
+@pytest.mark.parametrize('nms', [
+    occupancy_nms._greedy_occupancy_nms_loop,  # pylint: disable=protected-access
+    occupancy_nms._greedy_occupancy_nms_numpy,  # pylint: disable=protected-access
+])
+def test_matches_openpifpaf_occupancy(nms):
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        n_tracks = int(rng.integers(1, 20))
+        size = float(rng.uniform(10, 100))
+        data, joint_scales = random_tracks(rng, n_tracks, 17, size)
+        shape = (17, int(size / 2), int(size / 2))
+
+        expected_data = data.copy()
+        expected_occupancy = reference_nms(expected_data, joint_scales, shape)
+
+        occupied = occupancy_nms.OccupancyMap(shape, 2, min_scale=4)
+        nms(data, joint_scales, occupied.occupancy, 2.0, 2.0)
+
+        np.testing.assert_array_equal(data, expected_data)
+        np.testing.assert_array_equal(occupied.occupancy, expected_occupancy > 0)